@@ -1,8 +1,14 @@
 """Statistical indicators for analysis of price/volume trends."""
 import numpy as np
+import pandas as pd
 
 from . import etl
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
 def sma(df, col, window, centering=False):
     """Simple Moving Average (SMA)"""
     col = etl.sanitize_cols(df, col)
@@ -17,19 +23,67 @@ def wwma(values, n):
     """
      J. Welles Wilder's EMA
     """
-    return values.ewm(alpha=1/n, adjust=False).mean()
+    if isinstance(values, pd.DataFrame):
+        return values.apply(wwma, n=n)
+    if _wilder_kernel is None and isinstance(values, pd.Series):
+        return values.ewm(alpha=1 / n, adjust=False).mean()
+    array = np.ascontiguousarray(values, dtype=np.float64)
+    if array.ndim != 1:
+        raise TypeError(f"Values should be a Series, DataFrame or 1-D array. \nReceived {array.ndim}-D values")
+    if _wilder_kernel is None:
+        result = pd.Series(array).ewm(alpha=1 / n, adjust=False).mean().to_numpy()
+    else:
+        result = _wilder_kernel(array, 1 / n)
+    if isinstance(values, pd.Series):
+        return pd.Series(result, index=values.index, name=values.name)
+    return result
+
+def true_range(df):
+    """True Range: the largest of high - low, |high - prev close|, |low - prev close|."""
+    high = df['adjHigh'].to_numpy(dtype=np.float64)
+    low = df['adjLow'].to_numpy(dtype=np.float64)
+    close = df['adjClose'].to_numpy(dtype=np.float64)
+    prev_close = np.empty_like(close)
+    prev_close[:1] = np.nan
+    prev_close[1:] = close[:-1]
+
+    tr = np.abs(high - low)
+    gap = np.subtract(high, prev_close)
+    np.fmax(tr, np.abs(gap, out=gap), out=tr)  # fmax skips NaN, like DataFrame.max
+    np.subtract(low, prev_close, out=gap)
+    np.fmax(tr, np.abs(gap, out=gap), out=tr)
+    return pd.Series(tr, index=df.index)
 
 def atr(df, n=14):
-    data = df.copy()
-    high = data['adjHigh']
-    low = data['adjLow']
-    close = data['adjClose']
-    data['tr0'] = abs(high - low)
-    data['tr1'] = abs(high - close.shift())
-    data['tr2'] = abs(low - close.shift())
-    tr = data[['tr0', 'tr1', 'tr2']].max(axis=1)
-    atr = wwma(tr, n)
-    return atr
+    """Average True Range (ATR)"""
+    return wwma(true_range(df), n)
+
+def _wilder_loop(values, alpha):
+    """Wilder recursion, matching `ewm(alpha=alpha, adjust=False).mean()`."""
+    out = np.empty_like(values)
+    if len(values) == 0:
+        return out
+    decay = 1.0 - alpha
+    weighted = values[0]
+    old_wt = 1.0
+    out[0] = weighted
+    for i in range(1, len(values)):
+        cur = values[i]
+        if weighted == weighted:
+            old_wt *= decay
+            if cur == cur:
+                if weighted != cur:
+                    weighted = (old_wt * weighted + alpha * cur) / (old_wt + alpha)
+                old_wt = 1.0
+        elif cur == cur:
+            weighted = cur
+        out[i] = weighted
+    return out
+
+if numba is not None:
+    _wilder_kernel = numba.njit(cache=True, nogil=True)(_wilder_loop)
+else:
+    _wilder_kernel = None  # pandas ewm is already a compiled loop.
 
 def sma_crossover(df, col, fastfreq, slowfreq):
     """SMA Crossover indicator"""
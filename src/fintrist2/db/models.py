@@ -3,6 +3,7 @@ The engine that applies analyses to data and generates alerts.
 """
 import logging
 import pickle
+import time
 import arrow
 
 import pandas as pd
@@ -14,7 +15,7 @@ from mongoengine.fields import (
     BooleanField, BinaryField, GridFSProxy,
 )
 from mongoengine.errors import SaveConditionError, DoesNotExist
-from pymongo.errors import InvalidDocument
+from pymongo.errors import InvalidDocument, DuplicateKeyError, OperationFailure
 from mongoengine import signals
 from bson.dbref import DBRef
 
@@ -60,6 +61,10 @@ class Study(Document):
     versiondefault = StringField(default='default')
     _timestamp = StringField()
 
+    # Refresh lease
+    lock_owner = StringField()
+    lock_expires = DateTimeField()
+
     # Meta
     notes = MapField(ListField(StringField()))
     schema_version = IntField(default=1)
@@ -117,6 +122,73 @@ class Study(Document):
         except:
             return
 
+    ## Methods for single-flight refreshes ##
+    # Lease times come from the MongoDB server clock ($$NOW, MongoDB 4.2+),
+    # so clock skew between worker hosts doesn't matter.
+
+    def _lease_query(self, **conditions):
+        """Raw query matching this Study, plus extra raw conditions."""
+        query = {'name': self.name}
+        if self._meta.get('allow_inheritance'):
+            query['_cls'] = self._class_name
+        query.update(conditions)
+        return query
+
+    @staticmethod
+    def _lease_update(owner, ttl):
+        """Update pipeline setting the lease to expire `ttl` seconds from now."""
+        return [{'$set': {
+            'lock_owner': owner,
+            'lock_expires': {'$add': ['$$NOW', ttl * 1000]},
+        }}]
+
+    def acquire_lock(self, owner, ttl=60):
+        """Atomically take the refresh lease for `ttl` seconds.
+
+        Returns False if another owner holds an unexpired lease.
+        """
+        collection = self.__class__._get_collection()
+        free = self._lease_query(**{'$or': [
+            {'lock_expires': None},
+            {'$expr': {'$lt': ['$lock_expires', '$$NOW']}},
+        ]})
+        try:
+            result = collection.update_one(free, self._lease_update(owner, ttl), upsert=True)
+        except DuplicateKeyError:  # The Study exists and the lease is held.
+            return False
+        except OperationFailure as err:
+            raise RuntimeError(
+                f"Could not take the refresh lease for {self.name} ({err}). "
+                "Refresh leases need MongoDB 4.2 or later.") from err
+        return bool(result.matched_count or result.upserted_id is not None)
+
+    def renew_lock(self, owner, ttl=60):
+        """Extend the refresh lease, if `owner` still holds it."""
+        collection = self.__class__._get_collection()
+        held = self._lease_query(lock_owner=owner)
+        return bool(collection.update_one(held, self._lease_update(owner, ttl)).matched_count)
+
+    def release_lock(self, owner):
+        """Release the refresh lease, if `owner` still holds it."""
+        cls = self.__class__
+        cls.objects(name=self.name, lock_owner=owner).update_one(
+            unset__lock_owner=True,
+            unset__lock_expires=True,
+        )
+
+    @property
+    def locked(self):
+        """Check if any owner holds an unexpired refresh lease."""
+        collection = self.__class__._get_collection()
+        held = self._lease_query(**{'$expr': {'$gt': ['$lock_expires', '$$NOW']}})
+        return bool(collection.count_documents(held, limit=1))
+
+    def wait_lock(self, timeout=60, interval=0.5):
+        """Wait until the refresh lease is released or expires."""
+        deadline = time.time() + timeout
+        while self.locked and time.time() < deadline:
+            time.sleep(interval)
+
     ## Methods for handling inputs ##
 
     def add_params(self, newparams):
@@ -0,0 +1,130 @@
+"""
+Write-behind persistence of Study data.
+"""
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+
+__all__ = ('StudyWriter', 'WriteBehindError', 'writer')
+
+logger = logging.getLogger(__name__)
+
+class WriteBehindError(RuntimeError):
+    """One or more background Study writes failed."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        names = ', '.join(name for name, _ in errors)
+        super().__init__(f"Background write failed for Study(s) {names}.")
+
+class StudyWriter():
+    """Persists Study data on a background thread.
+
+    Writes queued for the same Study are coalesced, so only the newest data
+    is saved. The queue holds at most `maxsize` Studies; `put` blocks while
+    it is full. Failed writes are logged and raised from `flush`/`join`.
+
+    Writes go through a separate instance of each Study, so the instance
+    passed to `put` is never touched by the writer thread (and doesn't see
+    the new data until it is reloaded).
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._pending = OrderedDict()  # Study name -> (study, data, callbacks)
+        self._inflight = 0
+        self._errors = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def __repr__(self):
+        return f"StudyWriter: {len(self._pending)} pending"
+
+    def put(self, study, data, callback=None):
+        """Queue `data` to be saved into `study`.
+
+        `callback` is called once the write has finished, whether or not it
+        succeeded.
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("StudyWriter is closed.")
+            self._start()
+            name = study.name
+            if name not in self._pending:
+                while len(self._pending) >= self.maxsize:
+                    self._cond.wait()
+            _, _, callbacks = self._pending.get(name, (None, None, []))
+            if callback is not None:
+                callbacks.append(callback)
+            self._pending[name] = (study, data, callbacks)
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Block until every queued write has finished.
+
+        Raises WriteBehindError if any write failed since the last flush.
+        """
+        with self._cond:
+            done = self._cond.wait_for(
+                lambda: not self._pending and not self._inflight, timeout)
+            errors, self._errors = self._errors, []
+        if errors:
+            raise WriteBehindError(errors)
+        return done
+
+    def join(self, timeout=None):
+        """Flush the queue and stop the background thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush(0)
+
+    def _start(self):
+        """Start the background thread, if it isn't running."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='StudyWriter', daemon=True)
+            self._thread.start()
+            atexit.register(self.join)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+                name, (study, data, callbacks) = self._pending.popitem(last=False)
+                self._inflight += 1
+                self._cond.notify_all()
+            try:
+                target = self._detach(study)
+                target.data = data
+                target.save()
+            except Exception as ex:
+                logger.exception("Background write failed for %s", study)
+                with self._cond:
+                    self._errors.append((name, ex))
+            finally:
+                for callback in callbacks:
+                    try:
+                        callback()
+                    except Exception:
+                        logger.exception("Write callback failed for %s", study)
+                with self._cond:
+                    self._inflight -= 1
+                    self._cond.notify_all()
+
+    @staticmethod
+    def _detach(study):
+        """Get an instance of the Study that only the writer thread uses."""
+        target = study.db_obj
+        if target is study:  # Not saved yet.
+            target = study.__class__(name=study.name)
+        return target
+
+writer = StudyWriter()
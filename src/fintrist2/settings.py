@@ -25,5 +25,6 @@ class ConfigObj():
     APIKEY_TIINGO = os.getenv('APIKEY_TIINGO')
     APIKEY_IEX = os.getenv('APIKEY_IEX')
     TZ = os.getenv('TIMEZONE') or 'UTC'
+    FIXTURE_DIR = os.getenv('FIXTURE_DIR') or os.path.join('workspace', 'fixtures')
 
 Config = ConfigObj()
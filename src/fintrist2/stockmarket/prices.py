@@ -1,23 +1,47 @@
 """Stock market prices."""
+import logging
+import os
+import socket
+import threading
 import time
-import pandas as pd
-import pandas_datareader as pdr
+import uuid
 
-from pandas_datareader.tiingo import TiingoIEXHistoricalReader
-from alpaca_management.connect import trade_api
 from fintrist2 import Config
 from fintrist2.db.models import StockData
-from . import calendar
+from fintrist2.db.writer import writer
+from . import calendar, sources
+
+logger = logging.getLogger(__name__)
+
+_refresh_locks = {}  # Study name -> in-process refresh lock
 
 class Stock():
     """Pulls stock price data and caches it in MongoDB.
 
     freq: daily, or Xmin, or Yhour
+    writebehind: return fresh data immediately and save it in the background.
+        Call `Stock.flush()` to wait for pending saves.
+    stale: if another worker is already refreshing the data, use the previous
+        version instead of waiting for it.
+    source: source name or Source instance, e.g. a ReplaySource for offline use.
+    day: time (arrow) whose latest market session to pull intraday data for,
+        e.g. a recorded session to replay. Defaults to now.
+
+    Refreshes are single-flight: one thread or process takes a lease on the
+    StockData document and pulls the data, while the others wait for it.
+    The lease uses update pipelines, which need MongoDB 4.2 or later.
     """
+    lock_ttl = 120  # Seconds before an abandoned refresh lease expires.
     
-    def __init__(self, symbol, freq='daily', clearcache=False):
+    def __init__(self, symbol, freq='daily', clearcache=False, writebehind=False, stale=False,
+                 source=None, day=None):
         self.symbol = symbol
         self.freq = freq
+        self.source = source
+        self.day = day
+        self.writebehind = writebehind
+        self.stale = stale
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
         self.study = self.get_study()
         self.data = self.get_data(clearcache)
 
@@ -40,20 +64,96 @@ class Stock():
         return current
 
     def get_data(self, clearcache):
+        if clearcache or not self.valid:
+            data = self.refresh()
+            if data is not None:
+                return data
+        return self.study.data
+
+    def refresh(self):
+        """Pull and save fresh data, collapsing concurrent refreshes to one.
+
+        Threads share an in-process lock, and processes share a lease on the
+        StockData document. Returns None if another worker refreshed the data
+        first, or if the previous version is used instead (see `stale`).
+        """
+        before = self.study.timestamp
+        wait = not (self.stale and before)
+        local_lock = _refresh_locks.setdefault(self.study.name, threading.Lock())
+        if not local_lock.acquire(blocking=wait):
+            return None
+        try:
+            while True:
+                if self.study.acquire_lock(self.owner, self.lock_ttl):
+                    self.study = self.get_study()
+                    if self.study.timestamp == before:
+                        break
+                    self.study.release_lock(self.owner)
+                    return None
+                if not wait:
+                    return None
+                self.study.wait_lock(self.lock_ttl)
+                self.study = self.get_study()
+                if self.study.timestamp != before:
+                    return None
+            return self._pull(self._hold_lease())
+        finally:
+            local_lock.release()
+
+    def _pull(self, release):
+        """Pull the data and save it, then call `release`."""
         if self.freq == 'daily':
             pull_method = self.pull_daily
             kwargs = {}
         else:
             pull_method = self.pull_intraday
-            kwargs = {'freq': self.freq}
+            kwargs = {'freq': self.freq, 'day': self.day}
+
+        start = time.time()
+        try:
+            data = pull_method(**kwargs)
+            if self.writebehind:
+                writer.put(self.study, data, callback=release)
+            else:
+                self.study.data = data
+                self.study.save()
+        except BaseException:
+            release()
+            raise
+        if not self.writebehind:
+            release()
+        timelength = time.time() - start
+        print(f"Queried data in {timelength:.1f} sec")
+        return data
 
-        if clearcache or not self.valid:
-            start = time.time()
-            self.study.data = pull_method(**kwargs)
-            self.study.save()
-            timelength = time.time() - start
-            print(f"Queried data in {timelength:.1f} sec")
-        return self.study.data
+    def _hold_lease(self):
+        """Keep renewing the refresh lease until the returned `release` is called.
+
+        The lease outlives a slow pull or a queued write-behind save, and
+        only expires if this process dies.
+        """
+        study = self.study
+        stopped = threading.Event()
+
+        def renew():
+            while not stopped.wait(self.lock_ttl / 3):
+                try:
+                    if not study.renew_lock(self.owner, self.lock_ttl):
+                        logger.warning("Lost the refresh lease for %s", study)
+                except Exception:
+                    logger.exception("Could not renew the refresh lease for %s", study)
+
+        def release():
+            stopped.set()
+            study.release_lock(self.owner)
+
+        threading.Thread(target=renew, name=f"Lease {study.name}", daemon=True).start()
+        return release
+
+    @staticmethod
+    def flush(timeout=None):
+        """Wait for background saves to finish, raising any write errors."""
+        return writer.flush(timeout)
 
     def pull_daily(self, source=None, mock=None):
         """Get a stock quote history.
@@ -62,29 +162,10 @@ class Stock():
         ::params:: symbol, source
         ::alerts:: source: AV, source: Tiingo, ex-dividend, split, reverse split
         """
-        ## Get the data from whichever source
         if mock is not None:
-            source = 'mock'
-        elif not source:
-            source = 'Tiingo'
-        if source == 'AV':
-            data = pdr.get_data_alphavantage(self.symbol, api_key=Config.APIKEY_AV, start='1900')
-            data.index = pd.to_datetime(data.index)
-        elif source == 'Tiingo':
-            data = pdr.get_data_tiingo(self.symbol, api_key=Config.APIKEY_TIINGO, start='1900')
-
-            # Multiple stock symbols are possible
-            data = data.reset_index().set_index('date')
-            data.index = data.index.date
-            data.index.name = 'date'
-            data = data.set_index('symbol', append=True)
-            data = data.reorder_levels(['symbol', 'date'])
-            if isinstance(self.symbol, str):  ## Single symbol only
-                data = data.droplevel('symbol')
-        elif source == 'mock':
-            data = mock
-
-        return data
+            return mock
+        source = sources.get_source(source or self.source)
+        return source.daily(self.symbol)
 
     def pull_intraday(self, day=None, freq='5min', tz=None, source=None, mock=None):
         """Get intraday stock data.
@@ -95,52 +176,17 @@ class Stock():
         """
         ## Pick the day
         latest_day = calendar.latest_market_day(day)
-        open_time = latest_day[0].isoformat()
-        close_time = latest_day[1].isoformat()
         if tz is None:
             tz = Config.TZ
 
         ## Get the data
         if mock is not None:
             dfs = mock
-        elif source == 'Alpaca':
-            data = trade_api.get_barset(
-                self.symbol, timeframe='minute', start=open_time, end=close_time, limit=1000)
-            missing = [symbol for symbol, records in data.items() if not records]
-            if missing:
-                raise ValueError(f"No intraday data found for symbol(s) {', '.join(missing)}.")
-            dfs = {symbol: format_stockrecords(records, tz) for symbol, records in data.items()}
         else:
-            tiingo = TiingoIEXPriceVolume(self.symbol, api_key=Config.APIKEY_TIINGO, end=day, freq=freq)
-            dfs = tiingo.read()
+            source = sources.get_source(source or self.source)
+            dfs = source.intraday(self.symbol, latest_day, freq, tz, day)
 
         if isinstance(self.symbol, str):
             dfs = dfs.loc[self.symbol]
 
         return dfs
-
-class TiingoIEXPriceVolume(TiingoIEXHistoricalReader):
-    """Adds volume to the Tiingo/IEX intraday pricing data."""
-
-    @property
-    def params(self):
-        """Parameters to use in API calls"""
-        return {
-            "startDate": self.start.strftime("%Y-%m-%d"),
-            "endDate": self.end.strftime("%Y-%m-%d"),
-            "resampleFreq": self.freq,
-            "format": "json",
-            "columns": "open,high,low,close,volume",
-        }
-
-def format_stockrecords(records, tz):
-    """Reformat stock tick records as a dataframe."""
-    df = pd.DataFrame.from_records(records.__dict__['_raw'])
-    df = df.rename({
-        'o': 'open', 'c': 'close',
-        'l': 'low', 'h': 'high',
-        'v': 'volume', 't': 'timestamp'}, axis=1
-    )
-    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s', utc=True).dt.tz_convert(tz)
-    df = df.set_index('timestamp')
-    return df
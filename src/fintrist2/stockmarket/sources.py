@@ -0,0 +1,258 @@
+"""Stock price data sources."""
+import gzip
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+import pandas as pd
+import pandas_datareader as pdr
+
+from pandas_datareader.tiingo import TiingoIEXHistoricalReader
+from alpaca_management.connect import trade_api
+from fintrist2 import Config
+
+class Source():
+    """Base class for price data sources.
+
+    `fetch_*` methods return the raw API response, and `format_*` methods
+    turn it into the DataFrame(s) used by Stock.
+    """
+    name = None
+
+    def __repr__(self):
+        return f"Source: {self.name}"
+
+    def daily(self, symbol):
+        """Get a stock quote history."""
+        return self.format_daily(self.fetch_daily(symbol), symbol)
+
+    def intraday(self, symbol, session, freq, tz, day=None):
+        """Get intraday stock data for the market session."""
+        return self.format_intraday(self.fetch_intraday(symbol, session, freq, day), tz)
+
+    def fetch_daily(self, symbol):
+        raise ValueError(f"No daily data found for source {self.name}.")
+
+    def fetch_intraday(self, symbol, session, freq, day=None):
+        raise ValueError(f"No intraday data found for source {self.name}.")
+
+    def format_daily(self, raw, symbol):
+        return raw
+
+    def format_intraday(self, raw, tz):
+        return raw
+
+class TiingoSource(Source):
+    """Tiingo daily prices and Tiingo/IEX intraday prices."""
+    name = 'Tiingo'
+
+    def fetch_daily(self, symbol):
+        return pdr.get_data_tiingo(symbol, api_key=Config.APIKEY_TIINGO, start='1900')
+
+    def format_daily(self, raw, symbol):
+        # Multiple stock symbols are possible
+        data = raw.reset_index().set_index('date')
+        data.index = data.index.date
+        data.index.name = 'date'
+        data = data.set_index('symbol', append=True)
+        data = data.reorder_levels(['symbol', 'date'])
+        if isinstance(symbol, str):  ## Single symbol only
+            data = data.droplevel('symbol')
+        return data
+
+    def fetch_intraday(self, symbol, session, freq, day=None):
+        tiingo = TiingoIEXPriceVolume(symbol, api_key=Config.APIKEY_TIINGO, end=day, freq=freq)
+        return tiingo.read()
+
+class AVSource(Source):
+    """AlphaVantage daily prices."""
+    name = 'AV'
+
+    def fetch_daily(self, symbol):
+        return pdr.get_data_alphavantage(symbol, api_key=Config.APIKEY_AV, start='1900')
+
+    def format_daily(self, raw, symbol):
+        data = raw.copy(deep=False)
+        data.index = pd.to_datetime(data.index)
+        return data
+
+class AlpacaSource(Source):
+    """Alpaca intraday minute bars."""
+    name = 'Alpaca'
+
+    def fetch_intraday(self, symbol, session, freq, day=None):
+        data = trade_api.get_barset(
+            symbol, timeframe='minute', limit=1000,
+            start=session['market_open'].isoformat(), end=session['market_close'].isoformat())
+        missing = [symbol for symbol, records in data.items() if not records]
+        if missing:
+            raise ValueError(f"No intraday data found for symbol(s) {', '.join(missing)}.")
+        return {symbol: records.__dict__['_raw'] for symbol, records in data.items()}
+
+    def format_intraday(self, raw, tz):
+        return {symbol: format_stockrecords(records, tz) for symbol, records in raw.items()}
+
+SOURCES = {source.name: source for source in (TiingoSource, AVSource, AlpacaSource)}
+
+def get_source(source=None):
+    """Get a Source instance from a Source or a source name."""
+    if isinstance(source, Source):
+        return source
+    if source is None:
+        source = 'Tiingo'
+    try:
+        return SOURCES[source]()
+    except KeyError:
+        raise ValueError(f"Unknown source {source}. Use one of {', '.join(SOURCES)}.") from None
+
+class FixtureStore():
+    """Gzipped pickles of raw API responses.
+
+    Recently used fixtures stay in memory as compressed bytes, up to
+    `cachesize` bytes in total (0 disables the cache). Each `get` unpickles
+    a fresh copy, so callers can't alter later replays.
+    """
+
+    def __init__(self, path=None, compresslevel=6, cachesize=256 * 2**20):
+        self.path = path or Config.FIXTURE_DIR
+        self.compresslevel = compresslevel
+        self.cachesize = cachesize
+        self._cache = OrderedDict()  # key -> compressed bytes, least recent first
+        self._cached = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"FixtureStore: {self.path}"
+
+    def __contains__(self, key):
+        return key in self._cache or os.path.exists(self.filepath(key))
+
+    @staticmethod
+    def key(*parts):
+        """Build a fixture key from the request parameters."""
+        digest = hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+        return f"{parts[0]}_{parts[1]}_{digest}"
+
+    def filepath(self, key):
+        return os.path.join(self.path, f"{key}.pkl.gz")
+
+    def get(self, key):
+        """Load a fixture."""
+        with self._lock:
+            blob = self._cache.get(key)
+            if blob is not None:
+                self._cache.move_to_end(key)
+        if blob is None:
+            try:
+                with open(self.filepath(key), 'rb') as f:
+                    blob = f.read()
+            except FileNotFoundError:
+                raise KeyError(key) from None
+            self._remember(key, blob)
+        return pickle.loads(gzip.decompress(blob))
+
+    def put(self, key, raw):
+        """Save a fixture."""
+        blob = gzip.compress(
+            pickle.dumps(raw, protocol=pickle.HIGHEST_PROTOCOL), compresslevel=self.compresslevel)
+        os.makedirs(self.path, exist_ok=True)
+        filepath = self.filepath(key)
+        tmppath = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmppath, 'wb') as f:
+            f.write(blob)
+        os.replace(tmppath, filepath)
+        self._remember(key, blob)
+
+    def _remember(self, key, blob):
+        """Cache the compressed fixture, evicting the least recently used."""
+        with self._lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._cached -= len(old)
+            if len(blob) > self.cachesize:
+                return
+            self._cache[key] = blob
+            self._cached += len(blob)
+            while self._cached > self.cachesize:
+                _, old = self._cache.popitem(last=False)
+                self._cached -= len(old)
+
+class ReplaySource(Source):
+    """Records raw responses from another source, then replays them offline.
+
+    mode: 'auto' replays recorded fixtures and records missing ones,
+        'record' always fetches and overwrites, 'replay' never fetches.
+    latency: seconds of simulated network latency per replayed response.
+
+    Intraday fixtures are keyed by market session, so replaying them on a
+    later day needs the recorded day, e.g. `Stock(..., day=...)`.
+    """
+
+    def __init__(self, source=None, store=None, mode='auto', latency=0):
+        if mode not in ('auto', 'record', 'replay'):
+            raise ValueError(f"Unknown mode {mode}. Use auto, record, or replay.")
+        self.source = get_source(source)
+        self.store = store if store is not None else FixtureStore()
+        self.mode = mode
+        self.latency = latency
+        self.name = f"Replay {self.source.name}"
+
+    def fetch_daily(self, symbol):
+        key = self.store.key(self.source.name, 'daily', symbol)
+        return self._fetch(key, f"{symbol} daily", self.source.fetch_daily, symbol)
+
+    def fetch_intraday(self, symbol, session, freq, day=None):
+        sessiondate = session['market_open'].date().isoformat()
+        key = self.store.key(self.source.name, 'intraday', symbol, sessiondate, freq)
+        desc = f"{symbol} {freq} on {sessiondate}"
+        return self._fetch(key, desc, self.source.fetch_intraday, symbol, session, freq, day)
+
+    def format_daily(self, raw, symbol):
+        return self.source.format_daily(raw, symbol)
+
+    def format_intraday(self, raw, tz):
+        return self.source.format_intraday(raw, tz)
+
+    def _fetch(self, key, desc, fetch, *args):
+        """Replay the fixture at `key`, or record it from `fetch`."""
+        if self.mode != 'record':
+            try:
+                raw = self.store.get(key)
+            except KeyError:
+                if self.mode == 'replay':
+                    raise KeyError(f"No {self.source.name} fixture recorded for {desc}.") from None
+            else:
+                if self.latency:
+                    time.sleep(self.latency)
+                return raw
+        raw = fetch(*args)
+        self.store.put(key, raw)
+        return raw
+
+class TiingoIEXPriceVolume(TiingoIEXHistoricalReader):
+    """Adds volume to the Tiingo/IEX intraday pricing data."""
+
+    @property
+    def params(self):
+        """Parameters to use in API calls"""
+        return {
+            "startDate": self.start.strftime("%Y-%m-%d"),
+            "endDate": self.end.strftime("%Y-%m-%d"),
+            "resampleFreq": self.freq,
+            "format": "json",
+            "columns": "open,high,low,close,volume",
+        }
+
+def format_stockrecords(records, tz):
+    """Reformat raw stock tick records as a dataframe."""
+    df = pd.DataFrame.from_records(records)
+    df = df.rename({
+        'o': 'open', 'c': 'close',
+        'l': 'low', 'h': 'high',
+        'v': 'volume', 't': 'timestamp'}, axis=1
+    )
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s', utc=True).dt.tz_convert(tz)
+    df = df.set_index('timestamp')
+    return df
@@ -0,0 +1,88 @@
+"""Regression tests for the True Range / ATR and Wilder smoothing kernels."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from fintrist2.analysis import indicators
+
+KERNELS = [indicators._wilder_loop]
+if indicators._wilder_kernel is not None:  # Numba is installed.
+    KERNELS.append(indicators._wilder_kernel)
+
+def reference_atr(df, n=14):
+    """The frame-copy ATR that the kernels replaced."""
+    data = df.copy()
+    high = data['adjHigh']
+    low = data['adjLow']
+    close = data['adjClose']
+    data['tr0'] = abs(high - low)
+    data['tr1'] = abs(high - close.shift())
+    data['tr2'] = abs(low - close.shift())
+    tr = data[['tr0', 'tr1', 'tr2']].max(axis=1)
+    return tr.ewm(alpha=1/n, adjust=False).mean()
+
+def reference_wwma(values, n):
+    return pd.Series(values).ewm(alpha=1/n, adjust=False).mean().to_numpy()
+
+@pytest.fixture
+def prices():
+    rng = np.random.default_rng(0)
+    close = 100 + rng.standard_normal(5000).cumsum()
+    return pd.DataFrame({
+        'adjClose': close,
+        'adjHigh': close + rng.random(5000),
+        'adjLow': close - rng.random(5000),
+    }, index=pd.date_range('2020-01-01', periods=5000, freq='min'))
+
+@pytest.mark.parametrize('kernel', KERNELS)
+@pytest.mark.parametrize('values', [
+    [],
+    [3.0],
+    [np.nan],
+    [np.nan, np.nan, 1.0, 2.0, 4.0],
+    [1.0, np.nan, np.nan, 5.0, 3.0, np.nan],
+    [np.nan, 2.0, np.nan, 2.0, 2.0],
+], ids=['empty', 'one-row', 'all-nan', 'leading-nan', 'gaps', 'leading-and-gap'])
+@pytest.mark.parametrize('n', [1, 3, 14])
+def test_wilder_kernels_edge_cases(kernel, values, n):
+    values = np.array(values, dtype=np.float64)
+    np.testing.assert_allclose(kernel(values, 1 / n), reference_wwma(values, n), rtol=1e-10)
+
+@pytest.mark.parametrize('kernel', KERNELS)
+@pytest.mark.parametrize('n', [1, 2, 14, 200, 1e6])
+def test_wilder_kernels_long_series(kernel, n):
+    values = np.random.default_rng(1).random(20000) * 100
+    np.testing.assert_allclose(kernel(values, 1 / n), reference_wwma(values, n), rtol=1e-10)
+
+@pytest.fixture(params=['kernel', 'ewm'])
+def wilder_path(request, monkeypatch):
+    """Run wwma through the Numba kernel (if installed) and the pandas fallback."""
+    if request.param == 'ewm':
+        monkeypatch.setattr(indicators, '_wilder_kernel', None)
+    return request.param
+
+@pytest.mark.parametrize('n', [1, 14])
+def test_atr_matches_reference(prices, n, wilder_path):
+    expected = reference_atr(prices, n)
+    pd.testing.assert_series_equal(indicators.atr(prices, n), expected, rtol=1e-10)
+
+def test_atr_with_gaps(prices, wilder_path):
+    prices = prices.copy()
+    prices.iloc[[0, 10, 11, 500], :] = np.nan
+    pd.testing.assert_series_equal(indicators.atr(prices), reference_atr(prices), rtol=1e-10)
+
+def test_atr_does_not_modify_input(prices):
+    before = prices.copy()
+    indicators.atr(prices)
+    pd.testing.assert_frame_equal(prices, before)
+
+def test_wwma_types(prices, wilder_path):
+    series = prices['adjClose'].rename('close')
+    pd.testing.assert_series_equal(
+        indicators.wwma(series, 14), series.ewm(alpha=1/14, adjust=False).mean(), rtol=1e-10)
+    pd.testing.assert_frame_equal(
+        indicators.wwma(prices, 14), prices.ewm(alpha=1/14, adjust=False).mean(), rtol=1e-10)
+    np.testing.assert_allclose(
+        indicators.wwma(series.to_numpy(), 14), series.ewm(alpha=1/14, adjust=False).mean())
+    with pytest.raises(TypeError):
+        indicators.wwma(prices.to_numpy(), 14)
@@ -0,0 +1,208 @@
+"""Tests for single-flight Stock refreshes, using an in-memory StockData."""
+import threading
+import time
+from unittest import mock
+
+import pandas as pd
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from fintrist2.db.models import StockData
+from fintrist2.db.writer import StudyWriter
+from fintrist2.stockmarket import prices, sources
+
+STALE = 1  # Timestamp of data that needs a refresh; later saves are current.
+
+class FakeStockData():
+    """Keeps Study rows, including the refresh lease, in a shared dict."""
+    db = {}
+    guard = threading.Lock()
+    clock = STALE
+    gate = None  # threading.Event blocking saves until set
+
+    def __init__(self, name):
+        self.name = name
+        row = self.db.get(name, {})
+        self.timestamp = row.get('timestamp')
+        self.data = row.get('data')
+
+    def __repr__(self):
+        return f"FakeStockData: {self.name}"
+
+    @property
+    def db_obj(self):
+        return FakeStockData(self.name)
+
+    def save(self):
+        if self.gate is not None:
+            self.gate.wait(5)
+        with self.guard:
+            FakeStockData.clock += 1
+            row = self.db.setdefault(self.name, {})
+            row.update(data=self.data, timestamp=FakeStockData.clock)
+
+    def acquire_lock(self, owner, ttl=60):
+        with self.guard:
+            row = self.db.setdefault(self.name, {})
+            if row.get('lock_owner') and row['lock_expires'] > time.time():
+                return False
+            row.update(lock_owner=owner, lock_expires=time.time() + ttl)
+            return True
+
+    def renew_lock(self, owner, ttl=60):
+        with self.guard:
+            row = self.db.get(self.name, {})
+            if row.get('lock_owner') != owner:
+                return False
+            row['lock_expires'] = time.time() + ttl
+            return True
+
+    def release_lock(self, owner):
+        with self.guard:
+            row = self.db.get(self.name, {})
+            if row.get('lock_owner') == owner:
+                row.update(lock_owner=None, lock_expires=None)
+
+    @property
+    def locked(self):
+        row = self.db.get(self.name, {})
+        return bool(row.get('lock_owner')) and row['lock_expires'] > time.time()
+
+    def wait_lock(self, timeout=60, interval=0.01):
+        deadline = time.time() + timeout
+        while self.locked and time.time() < deadline:
+            time.sleep(interval)
+
+def save_as_other_worker(name, data):
+    """Save data the way another process would, then drop its lease."""
+    study = FakeStockData(name)
+    study.data = data
+    study.save()
+    study.release_lock('other')
+
+@pytest.fixture
+def pulls(monkeypatch):
+    """Patch Stock to use the fake Study and count its pulls."""
+    FakeStockData.db = {}
+    FakeStockData.clock = STALE
+    FakeStockData.gate = None
+    calls = []
+
+    def pull_daily(stock, **kwargs):
+        calls.append(stock.symbol)
+        time.sleep(0.05)
+        return f"{stock.symbol} data {len(calls)}"
+
+    monkeypatch.setattr(prices, 'StockData', FakeStockData)
+    monkeypatch.setattr(prices.calendar, 'market_current', lambda timestamp: timestamp > STALE)
+    monkeypatch.setattr(prices.Stock, 'pull_daily', pull_daily)
+    monkeypatch.setattr(prices, '_refresh_locks', {})
+    yield calls
+    if FakeStockData.gate is not None:
+        FakeStockData.gate.set()
+
+def test_threads_pull_once(pulls):
+    stocks = []
+    threads = [threading.Thread(target=lambda: stocks.append(prices.Stock('SPY')))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert pulls == ['SPY']
+    assert [stock.data for stock in stocks] == ['SPY data 1'] * 8
+    assert not FakeStockData('SPY_daily').locked
+
+def test_waiter_reuses_saved_data(pulls):
+    FakeStockData.db['SPY_daily'] = {
+        'data': 'old', 'timestamp': STALE,
+        'lock_owner': 'other', 'lock_expires': time.time() + 60}
+    stocks = []
+    waiter = threading.Thread(target=lambda: stocks.append(prices.Stock('SPY')))
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive()  # Waiting on the other worker's lease.
+    save_as_other_worker('SPY_daily', 'new')
+    waiter.join(5)
+    assert pulls == []
+    assert stocks[0].data == 'new'
+
+def test_stale_uses_previous_version(pulls):
+    FakeStockData.db['SPY_daily'] = {
+        'data': 'old', 'timestamp': STALE,
+        'lock_owner': 'other', 'lock_expires': time.time() + 60}
+    stock = prices.Stock('SPY', stale=True)
+    assert stock.data == 'old'
+    assert pulls == []
+
+def test_failed_pull_releases_lease(pulls, monkeypatch):
+    def pull_daily(stock, **kwargs):
+        raise ValueError("No daily data found.")
+
+    monkeypatch.setattr(prices.Stock, 'pull_daily', pull_daily)
+    with pytest.raises(ValueError):
+        prices.Stock('SPY')
+    assert not FakeStockData('SPY_daily').locked
+    assert not prices._refresh_locks['SPY_daily'].locked()
+
+def test_writebehind_releases_lease_after_save(pulls, monkeypatch):
+    studywriter = StudyWriter()
+    monkeypatch.setattr(prices, 'writer', studywriter)
+    FakeStockData.gate = threading.Event()
+    stock = prices.Stock('SPY', writebehind=True)
+    assert stock.data == 'SPY data 1'
+    assert FakeStockData('SPY_daily').locked  # Save still queued.
+    FakeStockData.gate.set()
+    studywriter.join(5)
+    assert not FakeStockData('SPY_daily').locked
+    assert FakeStockData.db['SPY_daily']['data'] == 'SPY data 1'
+
+class IntradaySource(sources.Source):
+    name = 'Intraday'
+
+    def fetch_intraday(self, symbol, session, freq, day=None):
+        return pd.DataFrame({'close': [3.0]}, index=[symbol])
+
+def test_intraday_replay_day(pulls, monkeypatch, tmp_path):
+    recorded = pd.Timestamp('2021-03-01 12:00', tz='America/New_York')
+    days = []
+
+    def latest_market_day(day):
+        days.append(day)
+        session = recorded if day is None else day
+        return pd.Series([session.normalize(), session.normalize()],
+                         index=['market_open', 'market_close'])
+
+    monkeypatch.setattr(prices.calendar, 'latest_market_day', latest_market_day)
+    prices.Stock('SPY', freq='5min', source=sources.ReplaySource(
+        IntradaySource(), store=sources.FixtureStore(path=str(tmp_path))))
+    recorded = recorded + pd.Timedelta(days=1)  # The next trading day.
+    offline = sources.ReplaySource(
+        IntradaySource(), store=sources.FixtureStore(path=str(tmp_path)), mode='replay')
+    with pytest.raises(KeyError):
+        prices.Stock('SPY', freq='5min', source=offline, clearcache=True)
+    stock = prices.Stock('SPY', freq='5min', source=offline, clearcache=True,
+                         day=recorded - pd.Timedelta(days=1))
+    assert stock.data['close'] == 3.0
+    assert days[-1] == recorded - pd.Timedelta(days=1)
+
+@pytest.fixture
+def collection(monkeypatch):
+    collection = mock.Mock()
+    monkeypatch.setattr(StockData, '_get_collection', classmethod(lambda cls: collection))
+    return collection
+
+def test_acquire_lock_query(collection):
+    collection.update_one.return_value = mock.Mock(matched_count=0, upserted_id='new')
+    assert StockData(name='SPY_daily').acquire_lock('me', ttl=30)
+    query, update = collection.update_one.call_args[0]
+    assert query['name'] == 'SPY_daily'
+    assert query['_cls'] == StockData._class_name
+    assert {'lock_expires': None} in query['$or']
+    assert update == [{'$set': {
+        'lock_owner': 'me', 'lock_expires': {'$add': ['$$NOW', 30000]}}}]
+    assert collection.update_one.call_args[1] == {'upsert': True}
+
+def test_acquire_lock_held(collection):
+    collection.update_one.side_effect = DuplicateKeyError("E11000 duplicate key")
+    assert not StockData(name='SPY_daily').acquire_lock('me')
@@ -0,0 +1,125 @@
+"""Tests for price sources and offline record/replay, using a stub Source."""
+import os
+
+import pandas as pd
+import pytest
+
+from fintrist2.stockmarket import sources
+
+SESSION = pd.Series([
+    pd.Timestamp('2021-03-01 09:30', tz='America/New_York'),
+    pd.Timestamp('2021-03-01 16:00', tz='America/New_York'),
+], index=['market_open', 'market_close'])
+
+class StubSource(sources.Source):
+    """Returns a small DataFrame per request, counting the requests."""
+    name = 'Stub'
+
+    def __init__(self):
+        self.calls = []
+
+    def fetch_daily(self, symbol):
+        self.calls.append(('daily', symbol))
+        return pd.DataFrame({'close': [1.0, 2.0]}, index=['a', 'b'])
+
+    def fetch_intraday(self, symbol, session, freq, day=None):
+        self.calls.append(('intraday', symbol, freq))
+        return pd.DataFrame({'close': [3.0]})
+
+    def format_daily(self, raw, symbol):
+        return raw.rename(columns={'close': symbol})
+
+@pytest.fixture
+def store(tmp_path):
+    return sources.FixtureStore(path=str(tmp_path))
+
+@pytest.fixture
+def stub():
+    return StubSource()
+
+def test_get_source():
+    assert isinstance(sources.get_source(), sources.TiingoSource)
+    assert isinstance(sources.get_source('AV'), sources.AVSource)
+    stub = StubSource()
+    assert sources.get_source(stub) is stub
+    with pytest.raises(ValueError):
+        sources.get_source('Yahoo')
+
+def test_missing_data_kind():
+    with pytest.raises(ValueError):
+        sources.AVSource().fetch_intraday('SPY', SESSION, '5min')
+
+def test_auto_records_then_replays(stub, store):
+    replay = sources.ReplaySource(stub, store=store)
+    first = replay.daily('SPY')
+    second = replay.daily('SPY')
+    pd.testing.assert_frame_equal(first, second)
+    assert list(first.columns) == ['SPY']  # Formatted by the wrapped source.
+    assert stub.calls == [('daily', 'SPY')]
+
+def test_replay_from_disk(stub, store):
+    sources.ReplaySource(stub, store=store).daily('SPY')
+    offline = sources.ReplaySource(
+        StubSource(), store=sources.FixtureStore(path=store.path), mode='replay')
+    pd.testing.assert_frame_equal(offline.daily('SPY'), stub.format_daily(stub.fetch_daily('SPY'), 'SPY'))
+    with pytest.raises(KeyError):
+        offline.daily('QQQ')
+    assert offline.source.calls == []
+
+def test_replay_missing_intraday(stub, store):
+    offline = sources.ReplaySource(stub, store=store, mode='replay')
+    with pytest.raises(KeyError, match='SPY 5min on 2021-03-01'):
+        offline.intraday('SPY', SESSION, '5min', 'UTC')
+
+def test_record_mode_refetches(stub, store):
+    replay = sources.ReplaySource(stub, store=store, mode='record')
+    replay.daily('SPY')
+    replay.daily('SPY')
+    assert stub.calls == [('daily', 'SPY')] * 2
+
+def test_unknown_mode(stub):
+    with pytest.raises(ValueError):
+        sources.ReplaySource(stub, mode='live')
+
+def test_intraday_keys(stub, store):
+    replay = sources.ReplaySource(stub, store=store)
+    replay.intraday('SPY', SESSION, '5min', 'UTC')
+    replay.intraday('SPY', SESSION, '5min', 'UTC')
+    replay.intraday('SPY', SESSION, '1min', 'UTC')
+    replay.intraday('QQQ', SESSION, '5min', 'UTC')
+    assert len(stub.calls) == 3
+
+def test_latency(stub, store, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(sources.time, 'sleep', sleeps.append)
+    replay = sources.ReplaySource(stub, store=store, latency=0.25)
+    replay.daily('SPY')  # Recorded, not replayed.
+    replay.daily('SPY')
+    assert sleeps == [0.25]
+
+def test_replays_are_independent(stub, store):
+    replay = sources.ReplaySource(stub, store=store)
+    data = replay.intraday('SPY', SESSION, '5min', 'UTC')
+    data.loc[0, 'close'] = -1
+    assert replay.intraday('SPY', SESSION, '5min', 'UTC').loc[0, 'close'] == 3.0
+
+def test_atomic_write(store):
+    store.put('key', {'a': 1})
+    assert os.listdir(store.path) == ['key.pkl.gz']
+    assert 'key' in store
+    assert store.get('key') == {'a': 1}
+
+def test_cache_eviction(tmp_path):
+    store = sources.FixtureStore(path=str(tmp_path))
+    store.put('a', 'x' * 1000)
+    store.cachesize = store._cached * 3 // 2  # Room for only one fixture.
+    store.put('b', 'y' * 1000)
+    assert list(store._cache) == ['b']
+    assert store.get('a') == 'x' * 1000  # Reloaded from disk.
+    assert list(store._cache) == ['a']
+
+def test_cache_disabled(tmp_path):
+    store = sources.FixtureStore(path=str(tmp_path), cachesize=0)
+    store.put('a', [1, 2])
+    assert store.get('a') == [1, 2]
+    assert not store._cache
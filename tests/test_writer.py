@@ -0,0 +1,110 @@
+"""Tests for the write-behind StudyWriter, using stub Studies instead of MongoDB."""
+import threading
+import time
+
+import pytest
+
+from fintrist2.db.writer import StudyWriter, WriteBehindError
+
+class StubStudy():
+    """Stands in for a Study, recording saves in a shared store."""
+    store = {}
+    saves = []
+    gate = None  # threading.Event blocking saves until set
+    fail = set()  # Study names whose saves raise
+
+    def __init__(self, name):
+        self.name = name
+        self.data = None
+
+    @property
+    def db_obj(self):
+        return StubStudy(self.name)
+
+    def save(self):
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.name in self.fail:
+            raise IOError(f"Cannot save {self.name}")
+        self.saves.append(self.name)
+        self.store[self.name] = self.data
+
+@pytest.fixture(autouse=True)
+def reset_stub():
+    StubStudy.store = {}
+    StubStudy.saves = []
+    StubStudy.gate = None
+    StubStudy.fail = set()
+
+@pytest.fixture
+def studywriter():
+    writer = StudyWriter(maxsize=2)
+    yield writer
+    if StubStudy.gate is not None:
+        StubStudy.gate.set()
+    writer.join(5)
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_flush_saves(studywriter):
+    study = StubStudy('SPY_daily')
+    studywriter.put(study, 1)
+    assert studywriter.flush(5)
+    assert StubStudy.store == {'SPY_daily': 1}
+    assert study.data is None  # Saved through a separate instance.
+
+def test_coalesce(studywriter):
+    StubStudy.gate = threading.Event()
+    studywriter.put(StubStudy('A'), 1)
+    assert wait_for(lambda: not studywriter._pending)  # A is in flight.
+    for data in (1, 2, 3):
+        studywriter.put(StubStudy('B'), data)
+    StubStudy.gate.set()
+    studywriter.flush(5)
+    assert StubStudy.saves == ['A', 'B']
+    assert StubStudy.store['B'] == 3
+
+def test_bounded_queue(studywriter):
+    StubStudy.gate = threading.Event()
+    studywriter.put(StubStudy('A'), 1)
+    assert wait_for(lambda: not studywriter._pending)
+    studywriter.put(StubStudy('B'), 1)
+    studywriter.put(StubStudy('C'), 1)
+    blocked = threading.Thread(target=studywriter.put, args=(StubStudy('D'), 1))
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()
+    studywriter.put(StubStudy('C'), 2)  # Coalescing never blocks.
+    StubStudy.gate.set()
+    blocked.join(5)
+    studywriter.flush(5)
+    assert sorted(StubStudy.saves) == ['A', 'B', 'C', 'D']
+
+def test_errors_surface_once(studywriter):
+    StubStudy.fail = {'A'}
+    studywriter.put(StubStudy('A'), 1)
+    studywriter.put(StubStudy('B'), 1)
+    with pytest.raises(WriteBehindError) as excinfo:
+        studywriter.flush(5)
+    assert [name for name, _ in excinfo.value.errors] == ['A']
+    assert StubStudy.store == {'B': 1}
+    assert studywriter.flush(5)
+
+def test_callback_after_failure(studywriter):
+    StubStudy.fail = {'A'}
+    called = []
+    studywriter.put(StubStudy('A'), 1, callback=lambda: called.append('A'))
+    with pytest.raises(WriteBehindError):
+        studywriter.flush(5)
+    assert called == ['A']
+
+def test_put_after_join(studywriter):
+    studywriter.put(StubStudy('A'), 1)
+    studywriter.join(5)
+    assert StubStudy.store == {'A': 1}
+    with pytest.raises(RuntimeError):
+        studywriter.put(StubStudy('A'), 2)